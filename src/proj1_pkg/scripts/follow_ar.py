@@ -9,6 +9,8 @@ import argparse
 import time
 import numpy as np
 import signal
+import threading
+from collections import OrderedDict
 
 from paths.trajectories import LinearTrajectory, CircularTrajectory, PolygonalTrajectory
 from paths.paths import MotionPath
@@ -31,39 +33,75 @@ import moveit_commander
 from moveit_msgs.msg import DisplayTrajectory, RobotState
 from sawyer_pykdl import sawyer_kinematics
 
-def lookup_tag(tag_number):
-    """
-    Given an AR tag number, this returns the position of the AR tag in the robot's base frame.
-    You can use either this function or try starting the scripts/tag_pub.py script.  More info
-    about that script is in that file.  
+# Robot trajectories already built by get_trajectory, most recently used last
+_TRAJ_CACHE = OrderedDict()
+_TRAJ_CACHE_SIZE = 32
 
-    Parameters
-    ----------
-    tag_number : int
+# How far the AR tag has to move (in meters) before a new trajectory is planned
+TAG_MOVE_TOLERANCE = 0.01
 
-    Returns
-    -------
-    3x' :obj:`numpy.ndarray`
-        tag position
+class TfCache:
+    """
+    Keeps the latest AR tag and gripper positions in the robot's base frame.
+    A background timer polls the shared tf buffer without blocking, so the
+    control loop only has to read the cached values.  You can also try
+    starting the scripts/tag_pub.py script; more info about that script is in
+    that file.
     """
+    def __init__(self, tf_buffer, tag_number, period=0.05):
+        """
+        Parameters
+        ----------
+        tf_buffer : :obj:`tf2_ros.Buffer`
+            shared buffer created once at node startup
+        tag_number : int
+        period : float
+            seconds between cache refreshes
+        """
+        self._tf_buffer = tf_buffer
+        self._tag_frame = 'ar_marker_{}'.format(tag_number)
+        self._lock = threading.Lock()
+        self.ar_pos = None
+        self.gripper_pos = None
+        self._timer = rospy.Timer(rospy.Duration(period), self._update)
 
-    tfBuffer = tf2_ros.Buffer()
-    listener = tf2_ros.TransformListener(tfBuffer)
+    def _lookup(self, to_frame):
+        try:
+            trans = self._tf_buffer.lookup_transform('base', to_frame, rospy.Time(0), rospy.Duration(0.0))
+        except tf2_ros.TransformException:
+            return None
+        t = trans.transform.translation
+        return np.array([t.x, t.y, t.z])
 
-    to_frame = 'ar_marker_{}'.format(tag_number)
-    done = True
+    def _update(self, event):
+        ar_pos = self._lookup(self._tag_frame)
+        gripper_pos = self._lookup('right_gripper_tip')
+        with self._lock:
+            if ar_pos is not None:
+                self.ar_pos = ar_pos
+            if gripper_pos is not None:
+                self.gripper_pos = gripper_pos
 
-    while not rospy.is_shutdown():
-        try:
-            trans = tfBuffer.lookup_transform('base', to_frame, rospy.Time(0), rospy.Duration(10.0))
-            break
-        except Exception as e:
-            print("Retrying ...")
+    def latest(self):
+        """
+        Blocks until both transforms have been seen at least once.
 
-    tag_pos = np.array([getattr(trans.transform.translation, dim) for dim in ('x', 'y', 'z')])
-    return tag_pos
+        Returns
+        -------
+        3x' :obj:`numpy.ndarray`
+            AR tag position
+        3x' :obj:`numpy.ndarray`
+            gripper tip position
+        """
+        while not rospy.is_shutdown():
+            with self._lock:
+                if self.ar_pos is not None and self.gripper_pos is not None:
+                    return self.ar_pos.copy(), self.gripper_pos.copy()
+            print("Waiting for {} and right_gripper_tip ...".format(self._tag_frame))
+            rospy.sleep(0.05)
+        return None, None
 
-def get_trajectory(limb, kin, ik_solver, tag_pos, args):
+def get_trajectory(limb, kin, ik_solver, current_position, tag_pos, args):
     """
     Returns an appropriate robot trajectory for the specified task.  You should 
     be implementing the path functions in paths.py and call them here
@@ -72,6 +110,8 @@ def get_trajectory(limb, kin, ik_solver, tag_pos, args):
     ----------
     task : string
         name of the task.  Options: line, circle, square
+    current_position : 3x' :obj:`numpy.ndarray`
+        current position of the gripper tip
     tag_pos : 3x' :obj:`numpy.ndarray`
         
     Returns
@@ -84,17 +124,17 @@ def get_trajectory(limb, kin, ik_solver, tag_pos, args):
 
     target_position = tag_pos
     target_position[2] = 0.3
-    tfBuffer = tf2_ros.Buffer()
-    listener = tf2_ros.TransformListener(tfBuffer)
-
-    try:
-        trans = tfBuffer.lookup_transform('base', 'right_gripper_tip', rospy.Time(0), rospy.Duration(10.0))
-    except Exception as e:
-        print(e)
-
-    current_position = np.array([getattr(trans.transform.translation, dim) for dim in ('x', 'y', 'z')])
     print("Current Position:", current_position)
 
+    # Reuse the robot trajectory (and the IK solves behind it) if the positions
+    # it was planned from haven't moved by more than a millimeter.  The circle
+    # only depends on the tag, so the gripper position is left out of its key.
+    start_key = None if task == 'circle' else tuple(np.round(current_position, 3))
+    key = (task, controller_name, num_way, start_key, tuple(np.round(target_position, 3)))
+    if key in _TRAJ_CACHE:
+        _TRAJ_CACHE.move_to_end(key)
+        return _TRAJ_CACHE[key]
+
     if task == 'line':
         trajectory = LinearTrajectory(current_position, target_position, 3)
     elif task == 'circle':
@@ -105,7 +145,12 @@ def get_trajectory(limb, kin, ik_solver, tag_pos, args):
     else:
         raise ValueError('task {} not recognized'.format(task))
     path = MotionPath(limb, kin, ik_solver, trajectory) 
-    return path.to_robot_trajectory(num_way, controller_name!='workspace')
+    robot_trajectory = path.to_robot_trajectory(num_way, controller_name!='workspace')
+
+    _TRAJ_CACHE[key] = robot_trajectory
+    if len(_TRAJ_CACHE) > _TRAJ_CACHE_SIZE:
+        _TRAJ_CACHE.popitem(last=False)
+    return robot_trajectory
 
 
 def get_controller(controller_name, limb, kin):
@@ -164,7 +209,7 @@ if __name__ == "__main__":
         'Options: left, right.  Default: left'
     )
     parser.add_argument('-rate', type=int, default=200, help="""
-        This specifies how many ms between loops.  It is important to use a rate
+        This specifies how many loops to run per second.  It is important to use a rate
         and not a regular while loop because you want the loop to refresh at a
         constant rate, otherwise you would have to tune your PD parameters if 
         the loop runs slower / faster.  Default: 200"""
@@ -183,7 +228,13 @@ if __name__ == "__main__":
     args = parser.parse_args()
 
     rospy.init_node('moveit_node')
-    
+
+    # Keep a single tf buffer for the lifetime of the node so lookups hit a
+    # warm cache instead of waiting for a fresh listener to fill up.
+    tf_buffer = tf2_ros.Buffer(cache_time=rospy.Duration(10.0))
+    tf_listener = tf2_ros.TransformListener(tf_buffer)
+    tf_cache = TfCache(tf_buffer, int(args.ar_marker))
+
     ik_solver = IK("base", "right_hand")
     limb = intera_interface.Limb(args.arm)
     kin = sawyer_kinematics(args.arm)
@@ -196,15 +247,47 @@ if __name__ == "__main__":
     except KeyboardInterrupt:
         sys.exit()
 
-    r = rospy.Rate(args.rate)
+    # Schedule against absolute deadlines so that slow iterations are reported
+    # instead of silently stretching the loop period
+    period = rospy.Duration(1.0 / args.rate)
+    next_deadline = rospy.Time.now() + period
+    last_tag_pos = None
     while not rospy.is_shutdown():
-        if (args.task == "circle"):
-            args.task = "line"
-            trajectory = get_trajectory(limb, kin, ik_solver, lookup_tag(int(args.ar_marker)), args)
-            controller.follow_ar_tag(trajectory, timeout=args.timeout, log=args.log)
-            args.task = "circle"
+        tag_pos, current_position = tf_cache.latest()
+        if tag_pos is None:
+            break
+
+        # Only plan again once the tag has actually moved
+        tag_moved = last_tag_pos is None or \
+            np.linalg.norm(tag_pos - last_tag_pos) >= TAG_MOVE_TOLERANCE
+        if tag_moved:
+            last_tag_pos = tag_pos.copy()
+            if (args.task == "circle"):
+                args.task = "line"
+                trajectory = get_trajectory(limb, kin, ik_solver, current_position, last_tag_pos.copy(), args)
+                controller.follow_ar_tag(trajectory, timeout=args.timeout, log=args.log)
+                args.task = "circle"
 
-        trajectory = get_trajectory(limb, kin, ik_solver, lookup_tag(int(args.ar_marker)), args)
-        controller.follow_ar_tag(trajectory, timeout=args.timeout, log=args.log)
+                tag_pos, current_position = tf_cache.latest()
+                if tag_pos is None:
+                    break
+            trajectory = get_trajectory(limb, kin, ik_solver, current_position, last_tag_pos.copy(), args)
+            controller.follow_ar_tag(trajectory, timeout=args.timeout, log=args.log)
+        elif args.task != "line":
+            # Circles and polygons keep tracing around a stationary tag.  The
+            # next polygon lap starts on the tag, where the previous one ended,
+            # and is planned from the same positions every time so that it is
+            # served from the trajectory cache.
+            lap_start = last_tag_pos.copy()
+            lap_start[2] = 0.3
+            trajectory = get_trajectory(limb, kin, ik_solver, lap_start, last_tag_pos.copy(), args)
+            controller.follow_ar_tag(trajectory, timeout=args.timeout, log=args.log)
+        # A line ends on the tag, so there's nothing left to do until it moves
 
-        r.sleep()
\ No newline at end of file
+        now = rospy.Time.now()
+        if now < next_deadline:
+            rospy.sleep(next_deadline - now)
+            next_deadline += period
+        else:
+            rospy.logwarn_throttle(1.0, 'control loop overrun by %.3fs' % (now - next_deadline).to_sec())
+            next_deadline = now + period
@@ -59,8 +59,8 @@ def lookup_tag(tag_number):
         print(e)
         print("Retrying ...")
 
-    tag_pos = [getattr(trans.transform.translation, dim) for dim in ('x', 'y', 'z')]
-    return np.array(tag_pos)
+    t = trans.transform.translation
+    return np.array([t.x, t.y, t.z])
 
 def get_trajectory(limb, kin, ik_solver, tag_pos, args):
     """
@@ -90,7 +90,8 @@ def get_trajectory(limb, kin, ik_solver, tag_pos, args):
     except Exception as e:
         print(e)
 
-    current_position = np.array([getattr(trans.transform.translation, dim) for dim in ('x', 'y', 'z')])
+    t = trans.transform.translation
+    current_position = np.array([t.x, t.y, t.z])
     print("Current Position:", current_position)
 
     if task == 'line':
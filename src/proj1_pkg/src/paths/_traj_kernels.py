@@ -0,0 +1,182 @@
+#!/usr/bin/env python
+"""
+Scalar kernels used by the trajectories in trajectories.py to evaluate a single
+time sample.  They are compiled with numba when it is installed and otherwise
+run as plain python.
+"""
+import functools
+import math
+
+try:
+    from numba import njit
+except ImportError:
+    def njit(*args, **kwargs):
+        """
+        Stand-in for numba.njit when numba isn't installed; returns the
+        function unchanged.
+        """
+        if len(args) == 1 and callable(args[0]) and not kwargs:
+            return args[0]
+        return lambda func: func
+
+@njit(cache=True, fastmath=True)
+def linear_pose(t, half_t, sx, sy, sz, hax, hay, haz, vx, vy, vz, hx, hy, hz):
+    """
+    Position along a LinearTrajectory at time t.
+
+    Parameters
+    ----------
+    t : float
+    half_t : float
+        half of the total time of the trajectory
+    sx, sy, sz : float
+        start position
+    hax, hay, haz : float
+        half of the acceleration
+    vx, vy, vz : float
+        maximum velocity, reached at half_t
+    hx, hy, hz : float
+        position at half_t
+
+    Returns
+    -------
+    (float, float, float)
+    """
+    dt = t - half_t
+    if dt <= 0.0:
+        tt = t * t
+        return sx + hax * tt, sy + hay * tt, sz + haz * tt
+    # Horner form of h + v*dt - ha*dt**2
+    return (hx + (vx - hax * dt) * dt,
+            hy + (vy - hay * dt) * dt,
+            hz + (vz - haz * dt) * dt)
+
+@njit(cache=True, fastmath=True)
+def linear_vel(t, half_t, ax, ay, az, vx, vy, vz):
+    """
+    Translational velocity along a LinearTrajectory at time t.
+
+    Parameters
+    ----------
+    t : float
+    half_t : float
+        half of the total time of the trajectory
+    ax, ay, az : float
+        acceleration
+    vx, vy, vz : float
+        maximum velocity, reached at half_t
+
+    Returns
+    -------
+    (float, float, float)
+    """
+    dt = t - half_t
+    if dt <= 0.0:
+        return ax * t, ay * t, az * t
+    return vx - ax * dt, vy - ay * dt, vz - az * dt
+
+@njit(cache=True, fastmath=True)
+def circular_angle(t, half_t, alpha, half_alpha, w_max, half_angle):
+    """
+    Angle and angular velocity along a CircularTrajectory at time t.
+
+    Parameters
+    ----------
+    t : float
+    half_t : float
+        half of the total time of the trajectory
+    alpha : float
+        angular acceleration
+    half_alpha : float
+        half of the angular acceleration
+    w_max : float
+        maximum angular velocity, reached at half_t
+    half_angle : float
+        angle reached at half_t
+
+    Returns
+    -------
+    (float, float)
+    """
+    dt = t - half_t
+    if dt <= 0.0:
+        return half_alpha * t * t, alpha * t
+    return half_angle + w_max * dt - half_alpha * dt * dt, w_max - alpha * dt
+
+@njit(cache=True, fastmath=True)
+def circular_pose(t, half_t, alpha, half_alpha, w_max, half_angle, radius, cx, cy, cz):
+    """
+    Position along a CircularTrajectory at time t.
+
+    Returns
+    -------
+    (float, float, float)
+    """
+    theta, _ = circular_angle(t, half_t, alpha, half_alpha, w_max, half_angle)
+    return cx + radius * math.cos(theta), cy + radius * math.sin(theta), cz
+
+@njit(cache=True, fastmath=True)
+def circular_vel(t, half_t, alpha, half_alpha, w_max, half_angle, radius):
+    """
+    Translational velocity in the xy plane along a CircularTrajectory at time t.
+
+    Returns
+    -------
+    (float, float)
+    """
+    theta, theta_dot = circular_angle(t, half_t, alpha, half_alpha, w_max, half_angle)
+    r_td = radius * theta_dot
+    return -r_td * math.sin(theta), r_td * math.cos(theta)
+
+@functools.lru_cache(maxsize=None)
+def specialized_linear(half_t):
+    """
+    Builds linear_pose / linear_vel with the timing of the trajectory folded in
+    as a constant, so the compiled code doesn't have to load it on every call.
+    Kernels are built once per distinct half_t.
+
+    Returns
+    -------
+    pose : function
+        pose(t, sx, sy, sz, hax, hay, haz, vx, vy, vz, hx, hy, hz)
+    vel : function
+        vel(t, ax, ay, az, vx, vy, vz)
+    """
+    half_t = float(half_t)
+
+    @njit(fastmath=True)
+    def pose(t, sx, sy, sz, hax, hay, haz, vx, vy, vz, hx, hy, hz):
+        return linear_pose(t, half_t, sx, sy, sz, hax, hay, haz, vx, vy, vz, hx, hy, hz)
+
+    @njit(fastmath=True)
+    def vel(t, ax, ay, az, vx, vy, vz):
+        return linear_vel(t, half_t, ax, ay, az, vx, vy, vz)
+
+    return pose, vel
+
+@functools.lru_cache(maxsize=None)
+def specialized_circular(half_t, alpha, half_alpha, w_max, half_angle):
+    """
+    Builds circular_pose / circular_vel with the angular profile folded in as
+    constants.  The profile only depends on the total time of the trajectory,
+    so kernels are built once per distinct duration.
+
+    Returns
+    -------
+    pose : function
+        pose(t, radius, cx, cy, cz)
+    vel : function
+        vel(t, radius)
+    """
+    half_t, alpha, half_alpha = float(half_t), float(alpha), float(half_alpha)
+    w_max, half_angle = float(w_max), float(half_angle)
+
+    @njit(fastmath=True)
+    def pose(t, radius, cx, cy, cz):
+        return circular_pose(t, half_t, alpha, half_alpha, w_max, half_angle, radius, cx, cy, cz)
+
+    @njit(fastmath=True)
+    def vel(t, radius):
+        return circular_vel(t, half_t, alpha, half_alpha, w_max, half_angle, radius)
+
+    return pose, vel
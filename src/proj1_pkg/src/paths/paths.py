@@ -20,6 +20,8 @@ except:
     pass
 
 class MotionPath:
+    delta_t = .01 # time step for the finite differences in jointspace points
+
     def __init__(self, limb, kin, ik_solver, trajectory):
         """
         Parameters
@@ -50,16 +52,25 @@ class MotionPath:
         """
         traj = JointTrajectory()
         traj.joint_names = self.limb.joint_names()
-        points = []
-        for t in np.linspace(0, self.trajectory.total_time, num=num_waypoints):
-            point = self.trajectory_point(t, jointspace)
-            points.append(point)
 
         # We want to make a final point at the end of the trajectory so that the 
         # controller has time to converge to the final point.
-        extra_point = self.trajectory_point(self.trajectory.total_time, jointspace)
-        extra_point.time_from_start = rospy.Duration.from_sec(self.trajectory.total_time + 1)
-        points.append(extra_point)
+        total_time = self.trajectory.total_time
+        times = np.append(np.linspace(0, total_time, num=num_waypoints), total_time)
+
+        # Sample every waypoint in one vectorized pass instead of per point
+        if jointspace:
+            poses = self.trajectory.target_pose_batch(times)
+            poses_1 = self.trajectory.target_pose_batch(times - self.delta_t)
+            poses_2 = self.trajectory.target_pose_batch(times - 2*self.delta_t)
+            points = [self.point_from_samples(t, True, x_t, x_t_1, x_t_2)
+                for t, x_t, x_t_1, x_t_2 in zip(times, poses, poses_1, poses_2)]
+        else:
+            poses = self.trajectory.target_pose_batch(times)
+            velocities = self.trajectory.target_velocity_batch(times)
+            points = [self.point_from_samples(t, False, x_t, v_t=v_t)
+                for t, x_t, v_t in zip(times, poses, velocities)]
+        points[-1].time_from_start = rospy.Duration.from_sec(total_time + 1)
 
         traj.points = points
         traj.header.frame_id = 'base'
@@ -91,15 +102,46 @@ class MotionPath:
         - 
         positions: [-0.11520713 -1.01663718 -1.13026189  1.91170776  0.5837694   1.05630898  -0.70543966]
 
+        """
+        if jointspace:
+            # trajectories reuse their output buffers, so take a copy per sample
+            x_t_2 = self.trajectory.target_pose(t-2*self.delta_t).copy()
+            x_t_1 = self.trajectory.target_pose(t-self.delta_t).copy()
+            x_t   = self.trajectory.target_pose(t).copy()
+            return self.point_from_samples(t, True, x_t, x_t_1, x_t_2)
+        x_t = self.trajectory.target_pose(t).copy()
+        v_t = self.trajectory.target_velocity(t).copy()
+        return self.point_from_samples(t, False, x_t, v_t=v_t)
+
+    def point_from_samples(self, t, jointspace, x_t, x_t_1=None, x_t_2=None, v_t=None):
+        """
+        Builds a ROS JointTrajectoryPoint() from workspace samples of the
+        trajectory that have already been computed.
+
+        Parameters
+        ----------
+        t : float
+        jointspace : bool
+            What kind of trajectory.  See trajectory_point
+        x_t : 7x' :obj:`numpy.ndarray`
+            pose of the end effector at time t
+        x_t_1 : 7x' :obj:`numpy.ndarray`
+            pose at time t - delta_t, only used in jointspace
+        x_t_2 : 7x' :obj:`numpy.ndarray`
+            pose at time t - 2*delta_t, only used in jointspace
+        v_t : 6x' :obj:`numpy.ndarray`
+            body-frame velocity at time t, only used in workspace
+
+        Returns
+        -------
+        :obj:`trajectory_msgs.msg.JointTrajectoryPoint`
         """
         point = JointTrajectoryPoint()
-        delta_t = .01
+        delta_t = self.delta_t
         if jointspace:
-            x_t, x_t_1, x_t_2 = None, None, None
-            ik_attempts = 0
-            theta_t_2 = self.get_ik(self.trajectory.target_pose(t-2*delta_t), seed=self.previous_computed_ik)
-            theta_t_1 = self.get_ik(self.trajectory.target_pose(t-delta_t), seed=self.previous_computed_ik)
-            theta_t   = self.get_ik(self.trajectory.target_pose(t), seed=self.previous_computed_ik)
+            theta_t_2 = self.get_ik(x_t_2, seed=self.previous_computed_ik)
+            theta_t_1 = self.get_ik(x_t_1, seed=self.previous_computed_ik)
+            theta_t   = self.get_ik(x_t, seed=self.previous_computed_ik)
             
             # we said you shouldn't simply take a finite difference when creating
             # the path, why do you think we're doing that here?
@@ -108,8 +150,8 @@ class MotionPath:
             point.accelerations = (theta_t - 2*theta_t_1 + theta_t_2) / (delta_t**2)
             self.previous_computed_ik = theta_t
         else:
-            point.positions = self.trajectory.target_pose(t)
-            point.velocities = self.trajectory.target_velocity(t)
+            point.positions = x_t
+            point.velocities = v_t
         point.time_from_start = rospy.Duration.from_sec(t)
         return point
 
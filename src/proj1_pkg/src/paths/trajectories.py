@@ -5,12 +5,27 @@ import matplotlib.pyplot as plt
 import matplotlib.animation as animation
 import argparse
 from sawyer_pykdl import sawyer_kinematics
+try:
+    from paths import _traj_kernels as kernels
+except ImportError:
+    # run as a script, where paths/ itself is on sys.path
+    import _traj_kernels as kernels
 """
 Set of classes for defining SE(3) trajectories for the end effector of a robot 
 manipulator
 """
 
+def _floats(*values):
+    """
+    Flattens scalars and arrays into a tuple of python floats.
+    """
+    return tuple(float(v) for v in np.hstack([np.ravel(v) for v in values]))
+
 class Trajectory:
+    # Orientation of the end effector with the gripper pointing down, shared by
+    # every trajectory in this file
+    _GRIPPER_DOWN_QUAT = np.array([0, 1, 0, 0], dtype=np.float64)
+    _GRIPPER_DOWN_QUAT.flags.writeable = False
 
     def __init__(self, total_time):
         """
@@ -20,6 +35,7 @@ class Trajectory:
             desired duration of the trajectory in seconds 
         """
         self.total_time = total_time
+        self._last_ik = None # last IK solution, used to seed the next solve
 
     def target_pose(self, time):
         """
@@ -58,9 +74,85 @@ class Trajectory:
         """
         pass
 
+    def target_pose_batch(self, times):
+        """
+        Evaluates target_pose at every entry of times.  Subclasses override
+        this with a vectorized version where one is available.
+        Parameters
+        ----------
+        times : Nx' :obj:`numpy.ndarray`
+
+        Returns
+        -------
+        Nx7 :obj:`numpy.ndarray`
+            desired configurations of the end effector, one per row
+        """
+        return np.vstack([np.copy(self.target_pose(t)) for t in times])
+
+    def target_velocity_batch(self, times):
+        """
+        Evaluates target_velocity at every entry of times.  Subclasses override
+        this with a vectorized version where one is available.
+        Parameters
+        ----------
+        times : Nx' :obj:`numpy.ndarray`
+
+        Returns
+        -------
+        Nx6 :obj:`numpy.ndarray`
+            desired body-frame velocities of the end effector, one per row
+        """
+        return np.vstack([np.copy(self.target_velocity(t)) for t in times])
+
+    def target_position_batch(self, times):
+        """
+        Positions only (no orientation) of the end effector at every entry of
+        times.
+        Parameters
+        ----------
+        times : Nx' :obj:`numpy.ndarray`
+
+        Returns
+        -------
+        Nx3 :obj:`numpy.ndarray`
+        """
+        return self.target_pose_batch(times)[:, :3]
+
+    def target_linear_velocity_batch(self, times):
+        """
+        Translational part only of the body-frame velocity at every entry of
+        times.
+        Parameters
+        ----------
+        times : Nx' :obj:`numpy.ndarray`
+
+        Returns
+        -------
+        Nx3 :obj:`numpy.ndarray`
+        """
+        return self.target_velocity_batch(times)[:, :3]
+
+    def _pose_rows(self, positions):
+        """
+        Appends the gripper-down orientation to every row of an Nx3 array of
+        positions.
+        """
+        return np.hstack((positions, np.broadcast_to(self._GRIPPER_DOWN_QUAT, (len(positions), 4))))
+
+    def _twist_rows(self, linear_velocities):
+        """
+        Appends a zero angular velocity to every row of an Nx3 array of linear
+        velocities.
+        """
+        return np.hstack((linear_velocities, np.zeros((len(linear_velocities), 3))))
+
     def target_joint_velocities(self, kin, current_joint_positions, time):
         target_pose = self.target_pose(time)
-        target_joint_positions = kin.inverse_kinematics(target_pose[:3], orientation=None)
+        # Warm-start IK from the previous solution, which is close to the next one
+        seed = self._last_ik if self._last_ik is not None else current_joint_positions
+        target_joint_positions = kin.inverse_kinematics(target_pose[:3], orientation=None, seed=list(seed))
+        if target_joint_positions is not None:
+            self._last_ik = target_joint_positions.copy()
         return target_joint_positions - current_joint_positions
 
 
@@ -78,8 +170,8 @@ class Trajectory:
         """
         trajectory_name = self.__class__.__name__
         times = np.linspace(0, self.total_time, num=num_waypoints)
-        target_positions = np.vstack([self.target_pose(t)[:3] for t in times])
-        target_velocities = np.vstack([self.target_velocity(t)[:3] for t in times])
+        target_positions = self.target_position_batch(times)
+        target_velocities = self.target_linear_velocity_batch(times)
         
         fig = plt.figure(figsize=plt.figaspect(0.5))
         colormap = plt.cm.brg(np.fmod(np.linspace(0, 1, num=num_waypoints), 1))
@@ -162,7 +254,19 @@ class LinearTrajectory(Trajectory):
         self.distance = self.goal_position - self.start_position
         self.acceleration = (self.distance * 4.0) / (self.total_time ** 2) # keep constant magnitude acceleration
         self.v_max = (self.total_time / 2.0) * self.acceleration # maximum velocity magnitude (at the halfway point)
-        self.desired_orientation = np.array([0, 1, 0, 0])
+        # constants of the route, cached so target_pose doesn't recompute them
+        self.half_time = total_time * 0.5
+        self.half_acc = 0.5 * self.acceleration
+        self.half_pos = start_position + self.half_acc * self.half_time ** 2 # position at the halfway point
+        # scratch buffers reused by target_pose / target_velocity
+        self._pose_buf = np.empty(7)
+        self._pose_buf[3:] = self._GRIPPER_DOWN_QUAT
+        self._vel_buf = np.zeros(6)
+        # scalar kernels from _traj_kernels specialized on the duration of the
+        # route, and the flat float arguments that vary per route
+        self._pose_kernel, self._vel_kernel = kernels.specialized_linear(float(self.half_time))
+        self._pose_args = _floats(start_position, self.half_acc, self.v_max, self.half_pos)
+        self._vel_args = _floats(self.acceleration, self.v_max)
 
 
     def target_pose(self, time):
@@ -181,24 +285,13 @@ class LinearTrajectory(Trajectory):
         Returns
         -------
         7x' :obj:`numpy.ndarray`
-            desired configuration in workspace coordinates of the end effector
+            desired configuration in workspace coordinates of the end effector.
+            The array is reused between calls; copy it if you need to keep it.
         """
-        if time <= self.total_time / 2.0:
-            # TODO: calculate the position of the end effector at time t, 
-            # For the first half of the trajectory, maintain a constant accelerationme
-            pos = self.start_position + 0.5 *self.acceleration* time**2
-        else:
-            # TODO: Calculate the position of the end effector at time t, 
-            # For the second half of the trajectory, maintain a constant acceleration
-            # Hint: Calculate the remaining distance to the goal position.
-            first_half = self.start_position + 0.5 * self.acceleration * (self.total_time / 2.0)  **2
-            time_remaining = time - (self.total_time / 2.0)
-
-            dec = self.v_max * time_remaining - 0.5 * self.acceleration* time_remaining ** 2
-
-            pos = first_half + dec 
-       
-        return np.hstack((pos, self.desired_orientation))
+        # Constant acceleration for the first half of the trajectory, then a
+        # constant deceleration starting from the halfway point
+        self._pose_buf[:3] = self._pose_kernel(time, *self._pose_args)
+        return self._pose_buf
 
 
     def target_velocity(self, time):
@@ -214,13 +307,34 @@ class LinearTrajectory(Trajectory):
         Returns
         -------
         6x' :obj:`numpy.ndarray`
-            desired body-frame velocity of the end effector
+            desired body-frame velocity of the end effector.
+            The array is reused between calls; copy it if you need to keep it.
         """
-        if time  <= self.total_time / 2.0:
-            linear_vel = self.acceleration * time
-        else:
-            linear_vel = self.v_max - self.acceleration * (time - self.total_time/2.0)
-        return np.hstack((linear_vel, np.zeros(3)))
+        self._vel_buf[:3] = self._vel_kernel(time, *self._vel_args)
+        return self._vel_buf
+
+    def target_position_batch(self, times):
+        times = np.asarray(times, dtype=float)
+        mask = (times <= self.half_time)[:, None]
+        t = times[:, None]
+        dt = t - self.half_time
+        return np.where(mask,
+                        self.start_position + self.half_acc * t * t,
+                        self.half_pos + (self.v_max - self.half_acc * dt) * dt)
+
+    def target_linear_velocity_batch(self, times):
+        times = np.asarray(times, dtype=float)
+        mask = (times <= self.half_time)[:, None]
+        t = times[:, None]
+        return np.where(mask,
+                        self.acceleration * t,
+                        self.v_max - self.acceleration * (t - self.half_time))
+
+    def target_pose_batch(self, times):
+        return self._pose_rows(self.target_position_batch(times))
+
+    def target_velocity_batch(self, times):
+        return self._twist_rows(self.target_linear_velocity_batch(times))
 
 
 
@@ -238,7 +352,22 @@ class CircularTrajectory(Trajectory):
         self.radius = radius
         self.angular_acceleration = (2 * np.pi * 4.0) / (self.total_time ** 2) # keep constant magnitude acceleration
         self.angular_v_max = (self.total_time / 2.0) * self.angular_acceleration # maximum velocity magnitude
-        self.desired_orientation = np.array([0, 1, 0, 0])
+        # constants of the route, cached so target_pose doesn't recompute them
+        self.half_time = total_time * 0.5
+        self.half_angular_acc = 0.5 * self.angular_acceleration
+        self.half_angle = np.pi # angle reached at the halfway point
+        self._center = tuple(float(c) for c in np.ravel(center_position))
+        # scratch buffers reused by target_pose / target_velocity
+        self._pose_buf = np.empty(7)
+        self._pose_buf[3:] = self._GRIPPER_DOWN_QUAT
+        self._vel_buf = np.zeros(6)
+        # scalar kernels from _traj_kernels specialized on the angular profile,
+        # which only depends on total_time, and the remaining float arguments
+        self._pose_kernel, self._vel_kernel = kernels.specialized_circular(
+            *_floats(self.half_time, self.angular_acceleration, self.half_angular_acc,
+                     self.angular_v_max, self.half_angle))
+        self._vel_args = (float(radius),)
+        self._pose_args = self._vel_args + self._center
 
     def target_pose(self, time):
         """
@@ -256,22 +385,13 @@ class CircularTrajectory(Trajectory):
         Returns
         -------
         7x' :obj:`numpy.ndarray`
-            desired configuration in workspace coordinates of the end effector
+            desired configuration in workspace coordinates of the end effector.
+            The array is reused between calls; copy it if you need to keep it.
         """
-        if time <= self.total_time / 2.0:
-            # TODO: calculate the ANGLE of the end effector at time t, 
-            # For the first half of the trajectory, maintain a constant acceleration
-            theta = 0.5 *self.angular_acceleration* time**2
-        else:
-            # TODO: Calculate the ANGLE of the end effector at time t, 
-            # For the second half of the trajectory, maintain a constant acceleration
-            # Hint: Calculate the remaining angle to the goal position. 
-            time_left = time - self.total_time / 2.0
-            theta = np.pi + self.angular_v_max * time_left - 0.5 *self.angular_acceleration*time_left**2
-
-        pos_d = np.ndarray.flatten(self.center_position + self.radius * np.array([np.cos(theta), np.sin(theta), 0]))
-        print(pos_d)
-        return np.hstack((pos_d, self.desired_orientation))
+        # Constant angular acceleration for the first half of the trajectory,
+        # then a constant angular deceleration
+        self._pose_buf[:3] = self._pose_kernel(time, *self._pose_args)
+        return self._pose_buf
 
     def target_velocity(self, time):
         """
@@ -286,22 +406,48 @@ class CircularTrajectory(Trajectory):
         Returns
         -------
         6x' :obj:`numpy.ndarray`
-            desired body-frame velocity of the end effector
+            desired body-frame velocity of the end effector.
+            The array is reused between calls; copy it if you need to keep it.
         """
-        if time <= self.total_time / 2.0:
-            # TODO: calculate ANGULAR position and velocity using the acceleration and time
-            # For the first half of the trajectory, we maintain a constant acceleration
-            theta = 0.5 *self.angular_acceleration* time**2
-            theta_dot = self.angular_acceleration * time
-        else:
-            # TODO: start slowing the ANGULAR velocity down from the maximum one
-            # For the second half of the trajectory, maintain a constant deceleration
-            time_left = time - self.total_time / 2.0
-            theta = np.pi + self.angular_v_max * time_left - 0.5 *self.angular_acceleration*time_left**2
-            time_remaining = time - self.total_time / 2.0
-            theta_dot = self.angular_v_max - self.angular_acceleration * time_remaining
-        vel_d = np.ndarray.flatten(self.radius * theta_dot * np.array([-np.sin(theta), np.cos(theta), 0]))
-        return np.hstack((vel_d, np.zeros(3)))
+        self._vel_buf[:2] = self._vel_kernel(time, *self._vel_args)
+        return self._vel_buf
+
+    def _angle_batch(self, times):
+        """
+        Vectorized angle and angular velocity along the circle.
+        """
+        times = np.asarray(times, dtype=float)
+        time_left = times - self.half_time
+        first = time_left <= 0
+        theta = np.where(first,
+                         self.half_angular_acc * times * times,
+                         self.half_angle + self.angular_v_max * time_left - self.half_angular_acc * time_left * time_left)
+        theta_dot = np.where(first,
+                             self.angular_acceleration * times,
+                             self.angular_v_max - self.angular_acceleration * time_left)
+        return theta, theta_dot
+
+    def target_position_batch(self, times):
+        theta, _ = self._angle_batch(times)
+        pos_d = np.empty((len(theta), 3))
+        pos_d[:] = np.ravel(self.center_position)
+        pos_d[:, 0] += self.radius * np.cos(theta)
+        pos_d[:, 1] += self.radius * np.sin(theta)
+        return pos_d
+
+    def target_linear_velocity_batch(self, times):
+        theta, theta_dot = self._angle_batch(times)
+        speed = self.radius * theta_dot
+        vel_d = np.zeros((len(theta), 3))
+        vel_d[:, 0] = -speed * np.sin(theta)
+        vel_d[:, 1] = speed * np.cos(theta)
+        return vel_d
+
+    def target_pose_batch(self, times):
+        return self._pose_rows(self.target_position_batch(times))
+
+    def target_velocity_batch(self, times):
+        return self._twist_rows(self.target_linear_velocity_batch(times))
 
 class PolygonalTrajectory(Trajectory):
     def __init__(self, start_position, ar_position, points, total_time):
@@ -313,14 +459,39 @@ class PolygonalTrajectory(Trajectory):
         ????? You're going to have to fill these in how you see fit
         """
         Trajectory.__init__(self, total_time)
-        self.trajectories = []
+        self.seg_dt = total_time / 4.0
+        self.inv_seg_dt = 4.0 / total_time
+        self.half_t = self.seg_dt / 2.0
+
+        # Each side is a linear segment with the same duration, so its constants
+        # are stored row by row in (4, 3) arrays rather than in four objects.
+        starts, goals = [], []
         current_position = start_position
         for i in range(4):
             target_position = ar_position + points[i]
-            self.trajectories.append(LinearTrajectory(current_position, target_position, total_time/4))
+            starts.append(current_position)
+            goals.append(target_position)
             current_position = target_position
-
-
+        self.start = np.array(starts, dtype=float)
+        self.goal = np.array(goals, dtype=float)
+        self.accel = ((self.goal - self.start) * 4.0) / (self.seg_dt ** 2) # keep constant magnitude acceleration
+        self.half_acc = 0.5 * self.accel
+        self.v_max = self.half_t * self.accel # maximum velocity (at the middle of each side)
+        self.half_pos = self.start + self.half_acc * self.half_t ** 2 # position at the middle of each side
+        # scratch buffers reused by target_pose / target_velocity
+        self._pose_buf = np.empty(7)
+        self._pose_buf[3:] = self._GRIPPER_DOWN_QUAT
+        self._vel_buf = np.zeros(6)
+
+    def _segment(self, time):
+        """
+        Returns the index of the side being traversed at the given time and the
+        time elapsed since the start of that side.  Times outside of
+        [0, total_time] are measured from the first or last side.
+        """
+        idx = int(time * self.inv_seg_dt)
+        idx = 3 if idx > 3 else (0 if idx < 0 else idx)
+        return idx, time - idx * self.seg_dt
 
     def target_pose(self, time):
         """
@@ -338,15 +509,18 @@ class PolygonalTrajectory(Trajectory):
         Returns
         -------
         7x' :obj:`numpy.ndarray`
-            desired configuration in workspace coordinates of the end effector
+            desired configuration in workspace coordinates of the end effector.
+            The array is reused between calls; copy it if you need to keep it.
         """
-        trajectory = self.trajectories[0]
-        for i in range(4):
-            if time <= (i+1)*self.total_time/4:
-                trajectory = self.trajectories[i]
-                break
-        return trajectory.target_pose(time/4)
-        
+        idx, local_t = self._segment(time)
+        dt = local_t - self.half_t
+        if dt <= 0:
+            pos = self.start[idx] + self.half_acc[idx] * local_t * local_t
+        else:
+            pos = self.half_pos[idx] + (self.v_max[idx] - self.half_acc[idx] * dt) * dt
+        self._pose_buf[:3] = pos
+        return self._pose_buf
+
     def target_velocity(self, time):
         """
         Returns the end effector's desired body-frame velocity at time t as a 6D
@@ -360,14 +534,47 @@ class PolygonalTrajectory(Trajectory):
         Returns
         -------
         6x' :obj:`numpy.ndarray`
-            desired body-frame velocity of the end effector
+            desired body-frame velocity of the end effector.
+            The array is reused between calls; copy it if you need to keep it.
         """
-        trajectory = self.trajectories[0]
-        for i in range(4):
-            if time <= (i+1)*self.total_time/4:
-                trajectory = self.trajectories[i]
-                break
-        return trajectory.target_velocity(time/4)
+        idx, local_t = self._segment(time)
+        dt = local_t - self.half_t
+        if dt <= 0:
+            linear_vel = self.accel[idx] * local_t
+        else:
+            linear_vel = self.v_max[idx] - self.accel[idx] * dt
+        self._vel_buf[:3] = linear_vel
+        return self._vel_buf
+
+    def _segment_batch(self, times):
+        """
+        Vectorized version of _segment.
+        """
+        times = np.asarray(times, dtype=float)
+        idx = np.clip((times * self.inv_seg_dt).astype(int), 0, 3)
+        return idx, times - idx * self.seg_dt
+
+    def target_position_batch(self, times):
+        idx, local_t = self._segment_batch(times)
+        t = local_t[:, None]
+        dt = t - self.half_t
+        return np.where(dt <= 0,
+                        self.start[idx] + self.half_acc[idx] * t * t,
+                        self.half_pos[idx] + (self.v_max[idx] - self.half_acc[idx] * dt) * dt)
+
+    def target_linear_velocity_batch(self, times):
+        idx, local_t = self._segment_batch(times)
+        t = local_t[:, None]
+        dt = t - self.half_t
+        return np.where(dt <= 0,
+                        self.accel[idx] * t,
+                        self.v_max[idx] - self.accel[idx] * dt)
+
+    def target_pose_batch(self, times):
+        return self._pose_rows(self.target_position_batch(times))
+
+    def target_velocity_batch(self, times):
+        return self._twist_rows(self.target_linear_velocity_batch(times))
 
 def define_trajectories(args):
     """ Define each type of trajectory with the appropriate parameters."""